@@ -1,13 +1,72 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+import asyncio
+import heapq
+import hmac
+import logging
 import os
-from supabase import create_client, Client
-from pytrends.request import TrendReq
-import pandas as pd
-import requests
-from typing import Dict
+import re
+import httpx
+import orjson
+from supabase import acreate_client, AsyncClientOptions
+from cachetools import TTLCache
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
 
-app = FastAPI(title="Wealth Trends Backend")
+# orjson-backed JSON responses (FastAPI's own ORJSONResponse is deprecated).
+# The trends endpoints return it directly so their large `raw` payloads skip
+# FastAPI's jsonable_encoder pass and go straight to orjson.
+class ORJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+logger = logging.getLogger(__name__)
+
+# Shared async HTTP client for outbound calls (Reddit) - created once per worker
+http_client: httpx.AsyncClient = None
+
+# Per-worker startup/shutdown: outbound HTTP client, Supabase client (uses env
+# vars directly, set in Vercel dashboard; async and kept on a pooled HTTP/2
+# connection), the TrendReq pool's condition and the trends insert flusher.
+# asyncio primitives are created here so they belong to the serving loop.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_KEY")
+    if not supabase_url or not supabase_key:
+        raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY in environment variables")
+
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=10,
+        headers={"User-Agent": "wealth-trends-app/1.0 (by /u/wealthuba)"},
+    )
+    app.state.db_http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30),
+    )
+    app.state.db = await acreate_client(
+        supabase_url, supabase_key, options=AsyncClientOptions(httpx_client=app.state.db_http)
+    )
+    app.state.trendreq_available = asyncio.Condition()
+    app.state.trend_rows = asyncio.Queue()
+    app.state.trend_flusher = asyncio.create_task(flush_trend_rows(app.state.trend_rows))
+    app.state.trend_flusher.add_done_callback(log_flusher_exit)
+    try:
+        yield
+    finally:
+        # Stopping the flusher writes out whatever is still buffered
+        app.state.trend_flusher.cancel()
+        await asyncio.gather(app.state.trend_flusher, return_exceptions=True)
+        await app.state.db_http.aclose()
+        await http_client.aclose()
+
+app = FastAPI(title="Wealth Trends Backend", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Vercel serverless needs this explicit handler export
 handler = app
@@ -21,117 +80,307 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Supabase client - uses env vars directly (set in Vercel dashboard)
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_KEY")
-if not supabase_url or not supabase_key:
-    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY in environment variables")
+# Trends rows are buffered and written in batches by one flusher task per
+# worker: a batch goes out at TREND_BATCH_SIZE rows or TREND_FLUSH_SECONDS
+# after its first row, whichever comes first.
+TREND_BATCH_SIZE = 50
+TREND_FLUSH_SECONDS = 0.2
+
+async def insert_trend_rows(rows: List[Dict]):
+    try:
+        await app.state.db.table("trends").insert(rows).execute()
+    except Exception:
+        logger.exception("Failed to store %d trends rows", len(rows))
+
+def log_flusher_exit(task: asyncio.Task):
+    # The flusher only stops by being cancelled on shutdown; anything else
+    # means queued rows are no longer being written
+    if not task.cancelled():
+        logger.error("Trends insert flusher stopped unexpectedly", exc_info=task.exception())
+
+async def flush_trend_rows(trend_rows: asyncio.Queue):
+    loop = asyncio.get_running_loop()
+    rows: List[Dict] = []
+    first_at = 0.0
+    inserting: asyncio.Task = None
+    try:
+        while True:
+            timeout = max(TREND_FLUSH_SECONDS - (loop.time() - first_at), 0) if rows else None
+            try:
+                row = await asyncio.wait_for(trend_rows.get(), timeout=timeout)
+                if not rows:
+                    first_at = loop.time()
+                rows.append(row)
+            except asyncio.TimeoutError:
+                pass
+
+            if rows and (len(rows) >= TREND_BATCH_SIZE or loop.time() - first_at >= TREND_FLUSH_SECONDS):
+                # Shielded so a shutdown cancel can't drop the batch mid-insert
+                inserting = asyncio.ensure_future(insert_trend_rows(rows))
+                rows = []
+                await asyncio.shield(inserting)
+                inserting = None
+    except asyncio.CancelledError:
+        if inserting is not None:
+            await inserting
+        while not trend_rows.empty():
+            rows.append(trend_rows.get_nowait())
+        if rows:
+            await insert_trend_rows(rows)
+        raise
 
-supabase: Client = create_client(supabase_url, supabase_key)
+# Simple API key verification (Authorization: Bearer <key>). Kept out of the
+# query string so keys don't end up in access logs or browser history.
+# The expected key is read once.
+EXPECTED_API_KEY = os.getenv("API_KEY", "").encode()
 
-# Simple API key verification (query param)
-def verify_api_key(api_key: str = Query(...)):
-    expected_key = os.getenv("API_KEY")
-    if not expected_key:
+def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(HTTPBearer())):
+    if not EXPECTED_API_KEY:
         raise RuntimeError("API_KEY not set in environment variables")
-    if api_key != expected_key:
+    if not hmac.compare_digest(credentials.credentials.encode(), EXPECTED_API_KEY):
         raise HTTPException(status_code=403, detail="Invalid API key")
-    return api_key
+    return credentials.credentials
+
+# Cache-Control. Trends responses are behind the API key, so only the caller's
+# own browser may keep them (a shared cache told `public`/`s-maxage` would serve
+# them to anyone without checking the key). The unauthenticated liveness
+# endpoints can be cached by Vercel's edge for half a minute.
+TRENDS_CACHE_CONTROL = "private, max-age=60"
+HEALTH_CACHE_CONTROL = "public, max-age=0, s-maxage=30"
 
 # Root endpoint - health check
 @app.get("/")
-def root():
+def root(response: Response):
+    response.headers["Cache-Control"] = HEALTH_CACHE_CONTROL
     return {
         "status": "live",
         "message": "Wealth Trends API - Ready",
         "docs": "/docs",
-        "test_endpoint": "/api/google-trends?query=ai&api_key=YOUR_KEY",
+        "test_endpoint": "/api/google-trends?query=ai (header: Authorization: Bearer YOUR_KEY)",
         "env_test": "/api/env-test"
     }
 
+# Search terms accepted by the trends endpoints; anything else is rejected by
+# FastAPI's validation before any upstream call is made
+QUERY_PATTERN = r"^[A-Za-z0-9 _\-+.]+$"
+
+# Words for Reddit keyword counts: letters/digits/apostrophes, at least 2 chars,
+# so trailing punctuation ("ai," vs "ai") doesn't split counts
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9']+")
+
+# Recent results per (platform, query), shared by every request in this worker.
+# Concurrent misses on the same key await one in-flight fetch task, so they all
+# get its result (or its exception) from a single upstream call.
+trends_cache: TTLCache = TTLCache(maxsize=512, ttl=300)
+trends_inflight: Dict[Tuple, asyncio.Task] = {}
+
+async def cached_trends(platform: str, query: str, fetch, *args) -> Tuple[Any, Dict]:
+    key = (platform, query.lower(), *args)
+    result = trends_cache.get(key)
+    if result is not None:
+        return result
+
+    task = trends_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch(query, *args))
+        trends_inflight[key] = task
+
+        def finish(task: asyncio.Task):
+            trends_inflight.pop(key, None)
+            if not task.cancelled() and task.exception() is None:
+                trends_cache[key] = task.result()
+
+        task.add_done_callback(finish)
+
+    # Shielded so one caller going away doesn't cancel the fetch for the rest
+    return await asyncio.shield(task)
+
+# TrendReq fetches a Google cookie when constructed, so keep built instances
+# around and reuse them. Each one mutates its payload state per query, so a
+# request checks one out for its whole fetch; the pool grows up to the limit.
+TRENDREQ_POOL_SIZE = 4
+trendreq_pool: List[Any] = []
+trendreq_created = 0
+
+@asynccontextmanager
+async def checkout_trendreq():
+    global trendreq_created
+    trendreq_available: asyncio.Condition = app.state.trendreq_available
+    async with trendreq_available:
+        await trendreq_available.wait_for(lambda: trendreq_pool or trendreq_created < TRENDREQ_POOL_SIZE)
+        pytrend = trendreq_pool.pop() if trendreq_pool else None
+        if pytrend is None:
+            trendreq_created += 1
+
+    if pytrend is None:
+        # Imported here so cold starts that never serve Google Trends skip it
+        from pytrends.request import TrendReq
+
+        try:
+            pytrend = await asyncio.to_thread(TrendReq, hl='en-US', tz=360, timeout=10)
+        except BaseException:
+            async with trendreq_available:
+                trendreq_created -= 1
+                trendreq_available.notify()
+            raise
+
+    try:
+        yield pytrend
+    finally:
+        async with trendreq_available:
+            trendreq_pool.append(pytrend)
+            trendreq_available.notify()
+
+async def fetch_google_trends(query: str) -> Tuple[Dict, Dict]:
+    # Only this path needs NumPy; keep it off the cold start for the other routes
+    import numpy as np
+
+    # pytrends is blocking, so run it off the event loop. The three fetches only
+    # read the widgets build_payload set up (each its own), so they can overlap.
+    async with checkout_trendreq() as pytrend:
+        await asyncio.to_thread(pytrend.build_payload, kw_list=[query], timeframe='today 5-y')
+        iot_df, related, regions_df = await asyncio.gather(
+            asyncio.to_thread(pytrend.interest_over_time),
+            asyncio.to_thread(pytrend.related_queries),
+            asyncio.to_thread(pytrend.interest_by_region),
+        )
+
+    # Simple analysis - mean period-over-period change per keyword, computed
+    # on the (timestamps x keywords) values of the frame pytrends returned
+    keywords = [kw for kw in iot_df.columns if kw != "isPartial"]
+    rising = {}
+    if keywords and len(iot_df) > 1:
+        arr = iot_df[keywords].to_numpy(dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = (arr[1:] - arr[:-1]) / arr[:-1]
+        # Steps from zero interest have no meaningful % change; leave them out
+        finite = np.isfinite(pct)
+        counts = finite.sum(axis=0)
+        means = np.divide(
+            np.where(finite, pct, 0.0).sum(axis=0),
+            counts,
+            out=np.full(len(keywords), np.nan),
+            where=counts > 0,
+        )
+        # Only a handful of keywords per payload, so a full argsort is fine
+        for i in np.argsort(-means)[:5]:
+            if not np.isnan(means[i]):
+                rising[keywords[i]] = float(means[i])
+
+    # Serialise the pytrends frames once, into plain JSON-ready structures
+    interest = iot_df.reset_index().to_dict(orient="list") if not iot_df.empty else {}
+    if "date" in interest:
+        interest["date"] = [ts.isoformat() for ts in interest["date"]]
+    related_queries = {
+        name: frame.to_dict("records") if frame is not None else []
+        for name, frame in (related.get(query) or {}).items()
+    }
+
+    raw = {
+        "interest_over_time": interest,
+        "related_queries": related_queries,
+        "interest_by_region": regions_df.to_dict()
+    }
+
+    analysis = {
+        "rising_keywords": rising,
+        "top_related": related_queries.get('top', [])[:5],
+        "insights": f"Top rising: {list(rising.keys())[0] if rising else 'N/A'}"
+    }
+    return raw, analysis
+
+async def fetch_reddit_trends(query: str, limit: int) -> Tuple[List[Dict], Dict]:
+    # One search call returns up to 100 posts. Reddit pages by an `after` cursor
+    # taken from the previous page, so larger limits could not be fetched in
+    # parallel anyway - the endpoint caps `limit` at 100.
+    url = "https://www.reddit.com/search.json"
+    response = await http_client.get(url, params={"q": query, "sort": "hot", "limit": limit})
+    response.raise_for_status()
+
+    data = orjson.loads(response.content)
+    posts = data.get("data", {}).get("children", [])
+    raw = [post["data"] for post in posts]
+
+    if not raw:
+        return [], {"insights": "No results found"}
+
+    # At most a few dozen posts - plain Python beats building a DataFrame here
+    top_posts = [
+        {field: post.get(field) for field in ("title", "score", "num_comments", "created_utc")}
+        for post in heapq.nlargest(5, raw, key=lambda post: post.get("score", 0))
+    ]
+
+    # Keyword frequency (simple) - count straight from each post's fields
+    # instead of joining everything into one big string first. findall +
+    # map(str.lower) + Counter.update keep the per-word loop in C.
+    word_counts = Counter()
+    for post in raw:
+        for field in ("title", "selftext"):
+            word_counts.update(map(str.lower, _WORD_RE.findall(post.get(field) or "")))
+    top_keywords = dict(word_counts.most_common(5))
+
+    analysis = {
+        "top_posts": top_posts,
+        "top_keywords": top_keywords,
+        "insights": f"Top post: {top_posts[0]['title']} ({top_posts[0]['score']} points, {top_posts[0]['num_comments']} comments)" if top_posts else "No posts"
+    }
+    return raw, analysis
+
 # Google Trends endpoint (no key needed for pytrends)
 @app.get("/api/google-trends")
-def google_trends(query: str = Query(...), api_key: str = Depends(verify_api_key)):
+async def google_trends(
+    query: str = Query(..., min_length=1, max_length=64, pattern=QUERY_PATTERN),
+    api_key: str = Depends(verify_api_key),
+):
     try:
-        pytrend = TrendReq(hl='en-US', tz=360)
-        pytrend.build_payload(kw_list=[query], timeframe='today 5-y')
-        interest = pytrend.interest_over_time().to_dict()
-        related = pytrend.related_queries()
-        regions = pytrend.interest_by_region().to_dict()
-
-        raw = {
-            "interest_over_time": interest,
-            "related_queries": related.get(query, {}),
-            "interest_by_region": regions
-        }
-
-        # Simple analysis
-        df = pd.DataFrame(interest)
-        if not df.empty:
-            rising = df.pct_change().mean().sort_values(ascending=False).head(5).to_dict()
-        else:
-            rising = {}
-
-        analysis = {
-            "rising_keywords": rising,
-            "top_related": related.get(query, {}).get('top', [])[:5],
-            "insights": f"Top rising: {list(rising.keys())[0] if rising else 'N/A'}"
-        }
-
-        # Store in Supabase
-        supabase.table("trends").insert({
+        raw, analysis = await cached_trends("google", query, fetch_google_trends)
+
+        # Store in Supabase - queued for the next batched insert
+        app.state.trend_rows.put_nowait({
             "platform": "google",
             "query": query,
             "raw": raw,
             "analysis": analysis,
-            "timestamp": pd.Timestamp.now().isoformat()
-        }).execute()
+            "timestamp": datetime.now().isoformat()
+        })
 
-        return {"platform": "google", "raw": raw, "analysis": analysis}
+        return ORJSONResponse(
+            {"platform": "google", "raw": raw, "analysis": analysis},
+            headers={"Cache-Control": TRENDS_CACHE_CONTROL},
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Google Trends error: {str(e)}")
 
 # Reddit trends (public JSON, no API key needed)
 @app.get("/api/reddit-trends")
-def reddit_trends(query: str = Query(...), api_key: str = Depends(verify_api_key)):
+async def reddit_trends(
+    query: str = Query(..., min_length=1, max_length=64, pattern=QUERY_PATTERN),
+    limit: int = Query(20, ge=1, le=100),
+    api_key: str = Depends(verify_api_key),
+):
     try:
-        headers = {"User-Agent": "wealth-trends-app/1.0 (by /u/wealthuba)"}
-        url = f"https://www.reddit.com/search.json?q={query}&sort=hot&limit=20"
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-
-        data = response.json()
-        posts = data.get("data", {}).get("children", [])
-        raw = [post["data"] for post in posts]
+        raw, analysis = await cached_trends("reddit", query, fetch_reddit_trends, limit)
 
         if not raw:
-            return {"platform": "reddit", "raw": [], "analysis": {"insights": "No results found"}}
-
-        df = pd.DataFrame(raw)
-        top_posts = df[["title", "score", "num_comments", "created_utc"]].sort_values("score", ascending=False).head(5).to_dict("records")
-
-        # Keyword frequency (simple)
-        all_text = " ".join(df["title"].fillna("") + " " + df["selftext"].fillna(""))
-        words = pd.Series(all_text.lower().split())
-        top_keywords = words.value_counts().head(5).to_dict()
-
-        analysis = {
-            "top_posts": top_posts,
-            "top_keywords": top_keywords,
-            "insights": f"Top post: {top_posts[0]['title']} ({top_posts[0]['score']} points, {top_posts[0]['num_comments']} comments)" if top_posts else "No posts"
-        }
+            return ORJSONResponse(
+                {"platform": "reddit", "raw": [], "analysis": analysis},
+                headers={"Cache-Control": TRENDS_CACHE_CONTROL},
+            )
 
-        # Store in Supabase
-        supabase.table("trends").insert({
+        # Store in Supabase - queued for the next batched insert
+        app.state.trend_rows.put_nowait({
             "platform": "reddit",
             "query": query,
             "raw": raw,
             "analysis": analysis,
-            "timestamp": pd.Timestamp.now().isoformat()
-        }).execute()
+            "timestamp": datetime.now().isoformat()
+        })
 
-        return {"platform": "reddit", "raw": raw, "analysis": analysis}
-    except requests.exceptions.RequestException as e:
+        return ORJSONResponse(
+            {"platform": "reddit", "raw": raw, "analysis": analysis},
+            headers={"Cache-Control": TRENDS_CACHE_CONTROL},
+        )
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Reddit request failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Reddit processing error: {str(e)}")
@@ -149,5 +398,6 @@ def env_test():
 
 # Placeholder for future endpoints (YouTube, X, etc.)
 @app.get("/api/health")
-def health():
+def health(response: Response):
+    response.headers["Cache-Control"] = HEALTH_CACHE_CONTROL
     return {"status": "healthy", "supabase_connected": bool(os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"))}